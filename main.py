@@ -53,7 +53,9 @@ def main(cfg: DictConfig):
 
         # Post-processing
         logger.info("Starting post-processing.")
-        post_processor = PostProcessing(output_dir_data, output_dir_ivus)  # Ensure it's called with the correct dirs
+        post_processor = PostProcessing(
+            output_dir_data, output_dir_ivus, generate_plots=cfg.main.generate_plots
+        )  # Ensure it's called with the correct dirs
         post_processor()
 
     if cfg.main.ivus:
@@ -1,57 +1,305 @@
 import numpy as np
-import matplotlib.pyplot as plt
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+from PIL import Image
 import pandas as pd
 import os
+import glob
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
 from loguru import logger
 import yaml
 
+# Low dpi and fast zlib compression keep PNG encoding cheap for the many monitoring plots
+PLOT_DPI = 80
+PNG_KWARGS = {'optimize': False, 'compress_level': 1}
+
+# Maximum number of rendered plots waiting to be encoded and written per process
+MAX_PENDING_WRITES = 8
+
+# Columns of the processed pressure CSV files used during post-processing
+CSV_COLUMNS = [
+    'time',
+    'peaks',
+    'p_aortic',
+    'p_aortic_smooth',
+    'p_distal_smooth',
+    'aortic_ratio',
+    'diastolic_ratio',
+    'iFR',
+    'mid_systolic_ratio',
+    'pd/pa',
+    'diastolic_integral_aortic',
+    'diastolic_integral_distal',
+    'systolic_integral_aortic',
+    'systolic_integral_distal',
+]
+
+# Smoothed pressure signals and ratios are read as float32 to halve memory traffic. `time` and `pd/pa` stay float64,
+# normalizing time within long recordings and the pd/pa quartile split both depend on the full precision. The
+# integrals stay float64 as well, their differences cancel badly in float32.
+CSV_DTYPES = {
+    column: np.float32
+    for column in (
+        'p_aortic_smooth',
+        'p_distal_smooth',
+        'aortic_ratio',
+        'diastolic_ratio',
+        'iFR',
+        'mid_systolic_ratio',
+    )
+}
+
+# Tokens in the file name and the measurement name used in the result columns, checked in order.
+# Adenosine files are named `pressure_ade` but their results are stored in the `ado` columns.
+NAME_TABLE = (('rest', 'rest'), ('ade', 'ado'), ('ado', 'ado'), ('dobu', 'dobu'))
+
+
+def get_measurement_name(file_name):
+    """
+    Returns the measurement name (rest, ado or dobu) encoded in the file name, or None if there is none.
+    """
+    for token, name in NAME_TABLE:
+        if token in file_name:
+            return name
+    return None
+
+
+# PostProcessing instance of the current worker process, set once per process by the executor initializer
+_worker_processor = None
+
+
+def _init_worker(processor):
+    """
+    Stores the processor in the worker process so it is not pickled with every file.
+    """
+    global _worker_processor
+    _worker_processor = processor
+
+
+def _process_file_in_worker(file_path):
+    """
+    Processes a single file with the processor of the current worker process.
+    Errors are logged and the file is skipped, so one bad recording does not abort the whole run.
+    """
+    try:
+        return _worker_processor.process_file(file_path)
+    except Exception as e:
+        logger.error(f"Error processing file {file_path}: {e}")
+        return None
+
+
+def _write_png(file_path, pixels):
+    """
+    Encodes the rendered RGB pixels as PNG and writes them to the file, used in a background thread.
+    """
+    try:
+        Image.fromarray(pixels).save(file_path, format='png', **PNG_KWARGS)
+    except Exception as e:
+        logger.error(f"Error writing plot {file_path}: {e}")
+
+
+def diastolic_peak_positions(data):
+    """
+    Returns the positional indices of the diastolic peaks (peaks == 2) in the DataFrame.
+    """
+    return np.flatnonzero(data['peaks'].to_numpy() == 2)
+
+
+def _partition_quantiles(values, quantiles):
+    """
+    Returns the linearly interpolated quantiles of the non-NaN values, matching pd.Series.quantile.
+    Uses a single O(N) np.partition instead of sorting the values for every quantile.
+    """
+    values = values[~np.isnan(values)]
+    if values.size == 0:
+        return np.full(len(quantiles), np.nan)
+
+    positions = np.asarray(quantiles) * (values.size - 1)
+    lower = np.floor(positions).astype(np.intp)
+    upper = np.minimum(lower + 1, values.size - 1)
+    partitioned = np.partition(values, np.unique(np.concatenate([lower, upper])))
+    return partitioned[lower] + (partitioned[upper] - partitioned[lower]) * (positions - lower)
+
+
+def _valid_time_bounds(time_arr, values, starts, ends):
+    """
+    Returns the mean normalized time of the first and last non-NaN value within the intervals [starts, ends].
+    The first and last valid positions are O(1) lookups in prefix arrays built once over the whole signal.
+    """
+    n = len(values)
+    positions = np.arange(n)
+    valid = ~np.isnan(values)
+
+    # Position of the next valid value at or after each position (n if none)
+    # and of the last valid value at or before it (-1 if none)
+    next_valid = np.minimum.accumulate(np.where(valid, positions, n)[::-1])[::-1]
+    prev_valid = np.maximum.accumulate(np.where(valid, positions, -1))
+
+    first = next_valid[starts]
+    last = prev_valid[ends]
+    has_valid = first <= ends
+    if not has_valid.any():
+        return np.nan, np.nan
+
+    start_t = time_arr[starts[has_valid]]
+    time_range = time_arr[ends[has_valid]] - start_t
+    start_time_mean = np.mean((time_arr[first[has_valid]] - start_t) / time_range)
+    end_time_mean = np.mean((time_arr[last[has_valid]] - start_t) / time_range)
+    return start_time_mean, end_time_mean
+
+
+def _scan_intervals(time_arr, aortic, diastolic, dpos):
+    """
+    Scans the intervals between consecutive diastolic peak positions and returns the mean normalized
+    start and end time of the valid aortic_ratio and diastolic_ratio values within the cardiac cycle.
+    """
+    starts, ends = dpos[:-1], dpos[1:]
+    start_time_aortic_mean, end_time_aortic_mean = _valid_time_bounds(time_arr, aortic, starts, ends)
+    start_time_diastolic_mean, end_time_diastolic_mean = _valid_time_bounds(time_arr, diastolic, starts, ends)
+    return start_time_aortic_mean, end_time_aortic_mean, start_time_diastolic_mean, end_time_diastolic_mean
+
 
 class PostProcessing:
-    def __init__(self, input_dir, output_dir):
+    def __init__(self, input_dir, output_dir, max_workers=None, generate_plots=True):
         # Load configuration
         with open('config.yaml', 'r') as file:
             config = yaml.safe_load(file)
-        
+
         self.ifr_df = pd.DataFrame()
         # initialize an empty dataframe with columns from config
-        self.result_df = pd.DataFrame(columns=config['main']['dataframe_columns'])
+        self.dataframe_columns = config['main']['dataframe_columns']
+        self.result_df = pd.DataFrame(columns=self.dataframe_columns)
+        # collect one row per patient and build the result dataframe once at the end
+        self._rows = {}
         self.output_dir = output_dir
         self.output_file = os.path.join(output_dir, 'results.xlsx')
         # Ensure the output directory exists
         os.makedirs(output_dir, exist_ok=True)
         # write empty dataframe to an excel file with the output path
-        self.result_df.to_excel(self.output_file, index=False)
+        self.write_results()
         self.input_dir = input_dir
+        # number of worker processes, None uses all available cores
+        self.max_workers = max_workers
+        # plots are skipped when only the tabular results are needed
+        self.generate_plots = generate_plots
+        # figures and the write pool are created lazily, once per process that draws plots
+        self._fig = None
+
+    def _ensure_plotting(self):
+        if self._fig is None:
+            self._init_plotting()
+
+    def _init_plotting(self):
+        # Reuse one figure per plot type for all files. Figures created without pyplot render with Agg and
+        # skip the GUI canvas without changing the global backend used by the interactive ivus tools.
+        self._fig = Figure(figsize=(10, 6), dpi=PLOT_DPI)
+        FigureCanvasAgg(self._fig)
+        self._ax = self._fig.subplots()
+        self._fig_over_time = Figure(figsize=(12, 8), dpi=PLOT_DPI)
+        FigureCanvasAgg(self._fig_over_time)
+        self._ax_over_time = self._fig_over_time.subplots()
+        # Rendered plots are PNG encoded and written in the background while the next plot or file is processed.
+        # The pool lives as long as the process, its threads finish all queued writes before the process exits.
+        self._io_pool = ThreadPoolExecutor(max_workers=4)
+        self._pending_writes = []
+
+    def __getstate__(self):
+        # Figures and the write pool are not sent to the worker processes, each worker creates its own
+        state = self.__dict__.copy()
+        for key in ('_ax', '_fig_over_time', '_ax_over_time', '_io_pool', '_pending_writes'):
+            state.pop(key, None)
+        state['_fig'] = None
+        return state
+
+    def _save_figure(self, fig, plot_filename):
+        """
+        Renders the figure and hands a copy of its pixels to the background pool for PNG encoding and writing,
+        so the figure can be reused right away.
+        """
+        fig.canvas.draw()
+        pixels = np.asarray(fig.canvas.buffer_rgba())[:, :, :3].copy()
+
+        # Bound the number of rendered plots held in memory while waiting to be written
+        self._pending_writes = [future for future in self._pending_writes if not future.done()]
+        if len(self._pending_writes) >= MAX_PENDING_WRITES:
+            wait(self._pending_writes, return_when=FIRST_COMPLETED)
+
+        self._pending_writes.append(self._io_pool.submit(_write_png, plot_filename, pixels))
 
     def __call__(self):
-        for subdir, dirs, files in os.walk(self.input_dir):
-            # Skip the root directory itself
-            if subdir == self.input_dir:
-                continue
-            # Process only CSV files in the subdirectories
-            for file in files:
-                if file.endswith('.csv'):
-                    file_path = os.path.join(subdir, file)
-                    self.process_file(file_path)
+        # Process only CSV files in the subdirectories, skipping the root directory itself
+        files = sorted(glob.glob(os.path.join(self.input_dir, '*', '**', '*.csv'), recursive=True))
+
+        # Files are independent, process them in parallel and merge the returned rows.
+        # The processor is handed to each worker process once instead of being pickled with every file.
+        try:
+            with ProcessPoolExecutor(
+                max_workers=self.max_workers, initializer=_init_worker, initargs=(self,)
+            ) as executor:
+                for row in executor.map(_process_file_in_worker, files):
+                    if row is not None:
+                        self.update_results_df(row)
+        finally:
+            # Build the result dataframe and write it once, also keeping the rows collected so far if processing failed
+            rows = list(self._rows.values())
+            columns = list(dict.fromkeys([*self.dataframe_columns, *(key for row in rows for key in row)]))
+            self.result_df = pd.DataFrame(rows, columns=columns)
+            self.write_results()
+
+    def write_results(self):
+        """
+        Writes results_df to the output Excel file using the xlsxwriter engine, which is much faster than openpyxl.
+        """
+        with pd.ExcelWriter(self.output_file, engine='xlsxwriter') as writer:
+            self.result_df.to_excel(writer, index=False)
 
     def process_file(self, file_path):
-        data = pd.read_csv(file_path)
         file_name = os.path.basename(file_path).split('.')[0]
         output_dir = os.path.dirname(file_path)
 
+        # Skip files without a known measurement name instead of storing them in the wrong columns
+        if get_measurement_name(file_name) is None:
+            logger.warning(f"Skipping {file_path}: no rest, ado or dobu measurement in the file name.")
+            return None
+
+        # The multithreaded pyarrow parser only reads the columns needed below
+        data = pd.read_csv(file_path, engine='pyarrow', usecols=CSV_COLUMNS, dtype=CSV_DTYPES)
+
+        # Split the data into low and high pd/pa groups and extract measurements once per group
+        dpos_all = diastolic_peak_positions(data)
+        data_lower, data_higher, dpos_lower, dpos_higher = self.split_df_by_pdpa(data, dpos_all)
+        groups = {'all': data, 'low': data_lower, 'high': data_higher}
+        dpos = {'all': dpos_all, 'low': dpos_lower, 'high': dpos_higher}
+        measurements = {
+            group_name: self.get_measurements(group_data, dpos[group_name]) for group_name, group_data in groups.items()
+        }
+
+        # The average curves are saved as data even when no plots are generated
+        average_curves = self.save_average_curves(groups, dpos, file_name, output_dir)
+
         # Generate plots and save them
-        self.plot_average_curve(data, file_name, output_dir)
-        self.plot_pdpa_iFR_midsystolic_over_time(data, file_name, output_dir)
+        if self.generate_plots:
+            self._ensure_plotting()
+            self.plot_average_curve(average_curves, measurements, file_name, output_dir)
+            self.plot_pdpa_iFR_midsystolic_over_time(data, file_name, output_dir)
+
+        return self.get_result_row(measurements, file_name)
 
-        # Extract measurements and update results_df
-        self.update_results_df(data, file_name)
+    def update_results_df(self, row):
+        """
+        Merges a result row into the existing row of the same patient, if any.
+        """
+        self._rows.setdefault(row['patient_id'], {}).update(row)
 
-    def update_results_df(self, data, file_name):
+    def get_result_row(self, measurements, file_name):
+        """
+        Builds the result row of a single file from its per-group measurements.
+        """
         # Extract the correct patient_id from the file_name
         patient_id = '_'.join(file_name.split('_')[:2])
-        name = 'rest' if 'rest' in file_name else 'ado' if 'ade' in file_name else 'dobu'
+        name = get_measurement_name(file_name)
 
-        # Get measurements for all data
+        # Measurements for all data
         (
             iFR_mean,
             mid_systolic_ratio_mean,
@@ -68,12 +316,25 @@ class PostProcessing:
             systolic_integral_aortic,
             systolic_integral_distal,
             systolic_integral_diff,
-        ) = self.get_measurements(data)
+        ) = measurements['all']
 
-        # Split data into low and high pd/pa groups and get their measurements
-        data_lower, data_higher = self.split_df_by_pdpa(data)
-        iFR_mean_low, mid_systolic_ratio_mean_low, pdpa_mean_low, mean_systolic_pressure_low, mean_diastolic_pressure_low, *_ = self.get_measurements(data_lower)
-        iFR_mean_high, mid_systolic_ratio_mean_high, pdpa_mean_high, mean_systolic_pressure_high, mean_diastolic_pressure_high, *_ = self.get_measurements(data_higher)
+        # Measurements of the low and high pd/pa groups
+        (
+            iFR_mean_low,
+            mid_systolic_ratio_mean_low,
+            pdpa_mean_low,
+            mean_systolic_pressure_low,
+            mean_diastolic_pressure_low,
+            *_,
+        ) = measurements['low']
+        (
+            iFR_mean_high,
+            mid_systolic_ratio_mean_high,
+            pdpa_mean_high,
+            mean_systolic_pressure_high,
+            mean_diastolic_pressure_high,
+            *_,
+        ) = measurements['high']
 
         new_data = {
             f'iFR_mean_{name}': iFR_mean,
@@ -102,169 +363,125 @@ class PostProcessing:
             f'systolic_integral_diff_{name}': systolic_integral_diff,
         }
 
-        if patient_id in self.result_df['patient_id'].values:
-            self.result_df.loc[self.result_df['patient_id'] == patient_id, new_data.keys()] = new_data.values()
-        else:
-            new_row = {'patient_id': patient_id, **new_data}
-            self.result_df = pd.concat([self.result_df, pd.DataFrame([new_row])], ignore_index=True)
+        return {'patient_id': patient_id, **new_data}
 
-        self.result_df.to_excel(self.output_file, index=False)
-
-    def get_average_curve_between_diastolic_peaks(self, ifr_df, signal='p_aortic_smooth', num_points=100):
+    def get_average_curves(self, ifr_df, signals=('p_aortic_smooth', 'p_distal_smooth'), num_points=100, dpos=None):
         """
-        Computes the average curve between diastolic peaks by scaling each interval to the same time length.
+        Computes the average curves of several signals between diastolic peaks in a single pass,
+        sharing the interval boundaries and interpolation weights between the signals.
 
         Parameters:
-        - ifr_df (pd.DataFrame): The DataFrame containing the signal and peak information.
-        - signal (str): The column name of the input signal to analyze.
+        - ifr_df (pd.DataFrame): The DataFrame containing the signals and peak information.
+        - signals (tuple): The column names of the input signals to analyze.
         - num_points (int): The number of points to normalize each interval to.
+        - dpos (np.ndarray): Precomputed positions of the diastolic peaks, computed from `ifr_df` if None.
 
         Returns:
-        - avg_curve (np.ndarray): The average curve of the signal.
-        - avg_time (np.ndarray): The normalized time axis corresponding to the average curve.
+        - avg_time (np.ndarray): The normalized time axis corresponding to the average curves.
+        - avg_curves (dict): The average curve of each signal, keyed by column name.
         """
-        # Extract indices of diastolic peaks
-        diastolic_indices = ifr_df.index[ifr_df['peaks'] == 2].tolist()
+        # Extract positions of diastolic peaks
+        sigs = ifr_df[list(signals)].to_numpy()
+        if dpos is None:
+            dpos = diastolic_peak_positions(ifr_df)
 
-        if len(diastolic_indices) < 2:
+        if len(dpos) < 2:
             raise ValueError("Not enough diastolic peaks to calculate intervals.")
 
-        # Initialize a list to store all rescaled intervals
-        rescaled_curves = []
-
-        for i in range(len(diastolic_indices) - 1):
-            start_idx = diastolic_indices[i]
-            end_idx = diastolic_indices[i + 1]
+        starts = dpos[:-1]
+        lengths = dpos[1:] - starts + 1
 
-            # Extract the interval data
-            interval_data = ifr_df.loc[start_idx:end_idx, signal].values
+        # Skip intervals with insufficient data
+        valid = lengths >= 2
+        starts, lengths = starts[valid], lengths[valid]
 
-            if len(interval_data) < 2:
-                # Skip intervals with insufficient data
-                continue
-
-            # Rescale the interval to have `num_points` using interpolation
-            original_time = np.linspace(0, 1, len(interval_data))
-            scaled_time = np.linspace(0, 1, num_points)
-            rescaled_curve = np.interp(scaled_time, original_time, interval_data)
-
-            rescaled_curves.append(rescaled_curve)
-
-        if len(rescaled_curves) == 0:
+        if len(starts) == 0:
             raise ValueError("No valid intervals found for averaging.")
 
-        # Convert the list of rescaled curves to a 2D NumPy array
-        rescaled_curves = np.array(rescaled_curves)
-
-        # Compute the average curve across all rescaled intervals
-        avg_curve = np.mean(rescaled_curves, axis=0)
+        # Rescale all intervals to `num_points` at once: map the common grid onto each interval's sample positions
+        # and blend linearly between the neighbouring samples, shape (n_intervals, num_points, n_signals)
         avg_time = np.linspace(0, 1, num_points)
+        x = avg_time[None, :] * (lengths[:, None] - 1)
+        lower = np.minimum(np.floor(x).astype(np.intp), lengths[:, None] - 1)
+        upper = np.minimum(lower + 1, lengths[:, None] - 1)
+        frac = (x - lower)[:, :, None]
+        lower_vals = sigs[starts[:, None] + lower]
+        upper_vals = sigs[starts[:, None] + upper]
+        rescaled_curves = np.where(frac > 0, lower_vals + (upper_vals - lower_vals) * frac, lower_vals)
 
-        return avg_time, avg_curve
+        # Compute the average curves across all rescaled intervals
+        avg_curves = np.mean(rescaled_curves, axis=0)
 
-    def split_df_by_pdpa(self, data):
+        return avg_time, {signal: avg_curves[:, i] for i, signal in enumerate(signals)}
+
+    def split_df_by_pdpa(self, data, dpos=None):
         """
         Splits the input DataFrame into two separate DataFrames based on the pd/pa ratio.
+        Also returns the positions of the diastolic peaks within each split DataFrame, `dpos` are the
+        precomputed positions for `data` and are computed if None.
         """
+        if dpos is None:
+            dpos = diastolic_peak_positions(data)
+
         if len(data) < 1000:
             logger.warning("Not enough data to split by low and high pd/pa ratio.")
-            return data.copy(), data.copy()
-
-        df_copy = data.copy()
+            return data, data, dpos, dpos
 
-        # get lower 25% of pd/pa ratio
-        lower_bound = df_copy['pd/pa'].quantile(0.25)
-        upper_bound = df_copy['pd/pa'].quantile(0.75)
+        # get lower and upper 25% of pd/pa ratio
+        pdpa = data['pd/pa'].to_numpy()
+        lower_bound, upper_bound = _partition_quantiles(pdpa, [0.25, 0.75])
+        mask_low = pdpa < lower_bound
+        mask_high = pdpa > upper_bound
 
-        df_low = df_copy[df_copy['pd/pa'] < lower_bound]
-        df_high = df_copy[df_copy['pd/pa'] > upper_bound]
+        # positions of the diastolic peaks within the split DataFrames
+        is_diastolic = data['peaks'].to_numpy() == 2
+        dpos_low = np.flatnonzero(is_diastolic[mask_low])
+        dpos_high = np.flatnonzero(is_diastolic[mask_high])
 
         # check if both DataFrames have at least 2 diastolic peaks otherwise return the original DataFrame
-        if len(df_low[df_low['peaks'] == 2]) < 2 or len(df_high[df_high['peaks'] == 2]) < 2:
+        if len(dpos_low) < 2 or len(dpos_high) < 2:
             logger.warning("Not enough diastolic peaks in the split DataFrames.")
-            return data.copy(), data.copy()
+            return data, data, dpos, dpos
 
-        return df_low, df_high
+        return data[mask_low], data[mask_high], dpos_low, dpos_high
 
-    def get_measurements(self, data):
+    def get_measurements(self, data, dpos=None):
         """
         Extracts iFR, mid_systolic_ratio and calculates mean, plus mean of pd/pa ratio.
         For diastolic_ratio and aortic_ratio, gets their start and end time within the cardiac cycle.
+        `dpos` are the precomputed positions of the diastolic peaks, computed from `data` if None.
         """
-        df_copy = data.copy()
+        if dpos is None:
+            dpos = diastolic_peak_positions(data)
 
         # Get the mean of iFR, mid_systolic_ratio, and pd/pa
-        iFR_mean = df_copy['iFR'].mean()
-        mid_systolic_ratio_mean = df_copy['mid_systolic_ratio'].mean()
-        pdpa_mean = df_copy['pd/pa'].mean()
-        mean_systolic_pressure = df_copy[df_copy['peaks'] == 1]['p_aortic'].mean()
-        mean_diastolic_pressure = df_copy[df_copy['peaks'] == 2]['p_aortic'].mean()
-        diastolic_integral_aortic = df_copy['diastolic_integral_aortic'].mean()
-        diastolic_integral_distal = df_copy['diastolic_integral_distal'].mean()
+        iFR_mean = data['iFR'].mean()
+        mid_systolic_ratio_mean = data['mid_systolic_ratio'].mean()
+        pdpa_mean = data['pd/pa'].mean()
+        mean_systolic_pressure = data[data['peaks'] == 1]['p_aortic'].mean()
+        mean_diastolic_pressure = data['p_aortic'].iloc[dpos].mean()
+        diastolic_integral_aortic = data['diastolic_integral_aortic'].mean()
+        diastolic_integral_distal = data['diastolic_integral_distal'].mean()
         diastolic_integral_diff = diastolic_integral_aortic - diastolic_integral_distal
-        systolic_integral_aortic = df_copy['systolic_integral_aortic'].mean()
-        systolic_integral_distal = df_copy['systolic_integral_distal'].mean()
+        systolic_integral_aortic = data['systolic_integral_aortic'].mean()
+        systolic_integral_distal = data['systolic_integral_distal'].mean()
         systolic_integral_diff = systolic_integral_aortic - systolic_integral_distal
 
         # Get the start and end time of diastolic_ratio and aortic_ratio
-        diastolic_indices = df_copy.index[df_copy['peaks'] == 2].tolist()
+        # Work on the underlying arrays with positional indices, the interval scan is fully vectorized
+        time_arr = data['time'].to_numpy(dtype=np.float64)
+        aortic = data['aortic_ratio'].to_numpy()
+        diastolic = data['diastolic_ratio'].to_numpy()
 
-        if len(diastolic_indices) < 2:
+        if len(dpos) < 2:
             raise ValueError("Not enough diastolic peaks to calculate intervals.")
 
-        # Initialize a list to store all rescaled intervals
-        start_time_aortic = []
-        end_time_aortic = []
-        start_time_diastolic = []
-        end_time_diastolic = []
-
-        for i in range(len(diastolic_indices) - 1):
-            start_idx = diastolic_indices[i]
-            end_idx = diastolic_indices[i + 1]
-
-            start_t = df_copy.loc[start_idx, 'time']
-            end_t = df_copy.loc[end_idx, 'time']
-            time_range = end_t - start_t
-
-            # Extract the interval data for aortic_ratio
-            interval_data = df_copy.loc[start_idx:end_idx, 'aortic_ratio']
-
-            # Find the first and last non-NaN indices
-            first_valid_idx = interval_data.first_valid_index()
-            last_valid_idx = interval_data.last_valid_index()
-
-            if first_valid_idx is not None:
-                # Normalize the time of the first valid value
-                first_time = df_copy.loc[first_valid_idx, 'time']
-                normalized_start = (first_time - start_t) / time_range
-                start_time_aortic.append(normalized_start)
-
-            if last_valid_idx is not None:
-                # Normalize the time of the last valid value
-                last_time = df_copy.loc[last_valid_idx, 'time']
-                normalized_end = (last_time - start_t) / time_range
-                end_time_aortic.append(normalized_end)
-
-            # Repeat the same process for diastolic_ratio
-            interval_data = df_copy.loc[start_idx:end_idx, 'diastolic_ratio']
-
-            first_valid_idx = interval_data.first_valid_index()
-            last_valid_idx = interval_data.last_valid_index()
-
-            if first_valid_idx is not None:
-                first_time = df_copy.loc[first_valid_idx, 'time']
-                normalized_start = (first_time - start_t) / time_range
-                start_time_diastolic.append(normalized_start)
-
-            if last_valid_idx is not None:
-                last_time = df_copy.loc[last_valid_idx, 'time']
-                normalized_end = (last_time - start_t) / time_range
-                end_time_diastolic.append(normalized_end)
-
-        start_time_aortic_mean = np.mean(start_time_aortic)
-        end_time_aortic_mean = np.mean(end_time_aortic)
-        start_time_diastolic_mean = np.mean(start_time_diastolic)
-        end_time_diastolic_mean = np.mean(end_time_diastolic)
+        (
+            start_time_aortic_mean,
+            end_time_aortic_mean,
+            start_time_diastolic_mean,
+            end_time_diastolic_mean,
+        ) = _scan_intervals(time_arr, aortic, diastolic, dpos)
 
         return (
             iFR_mean,
@@ -284,34 +501,44 @@ class PostProcessing:
             systolic_integral_diff,
         )
 
-    def plot_average_curve(self, data, file_name, output_dir):
+    def save_average_curves(self, groups, dpos, file_name, output_dir):
         """
-        Plots the average curve between diastolic peaks for `p_aortic_smooth` and `p_distal_smooth`
-        for all data, low `pd/pa`, and high `pd/pa` groups. Saves three plots.
+        Computes the average curve between diastolic peaks for `p_aortic_smooth` and `p_distal_smooth`
+        for all data, low `pd/pa`, and high `pd/pa` groups and saves each to a csv file.
+        `dpos` holds the precomputed diastolic peak positions for each group.
+        Returns a dict keyed by group name ('all', 'low', 'high') of DataFrames with the columns time,
+        p_aortic_smooth and p_distal_smooth.
         """
-        name = 'rest' if 'rest' in file_name else 'ado' if 'ade' in file_name else 'dobu'
-        data = data.copy()
-
-        # Split the data into low and high pd/pa groups
-        data_lower, data_higher = self.split_df_by_pdpa(data)
-
-        # Define the groups to process
-        groups = {'all': data, 'low': data_lower, 'high': data_higher}
+        average_curves = {}
 
         for group_name, group_data in groups.items():
-            # Calculate average curves
-            avg_time, avg_curve_aortic = self.get_average_curve_between_diastolic_peaks(
-                group_data, signal='p_aortic_smooth', num_points=100
-            )
-            _, avg_curve_distal = self.get_average_curve_between_diastolic_peaks(
-                group_data, signal='p_distal_smooth', num_points=100
+            # Calculate average curves of both signals in a single pass
+            avg_time, avg_curves = self.get_average_curves(
+                group_data, signals=('p_aortic_smooth', 'p_distal_smooth'), num_points=100, dpos=dpos[group_name]
             )
 
             # create DF with avg_time, avg_curve_aortic and avg_curve_distal and save it to a csv file
-            df = pd.DataFrame({'time': avg_time, 'p_aortic_smooth': avg_curve_aortic, 'p_distal_smooth': avg_curve_distal})
+            df = pd.DataFrame({'time': avg_time, **avg_curves})
             df.to_csv(os.path.join(output_dir, f"{file_name}_average_curve_{group_name}.csv"), index=False)
+            average_curves[group_name] = df
+
+        return average_curves
 
-            # Get measurements
+    def plot_average_curve(self, average_curves, measurements, file_name, output_dir):
+        """
+        Plots the average curve between diastolic peaks for `p_aortic_smooth` and `p_distal_smooth`
+        for all data, low `pd/pa`, and high `pd/pa` groups. Saves three plots.
+        `average_curves` and `measurements` hold the output of `save_average_curves` and
+        `get_measurements` for each group.
+        """
+        name = get_measurement_name(file_name)
+
+        for group_name, df in average_curves.items():
+            avg_time = df['time']
+            avg_curve_aortic = df['p_aortic_smooth']
+            avg_curve_distal = df['p_distal_smooth']
+
+            # Unpack the precomputed measurements
             (
                 iFR_mean,
                 mid_systolic_ratio_mean,
@@ -323,72 +550,73 @@ class PostProcessing:
                 start_time_diastolic_mean,
                 end_time_diastolic_mean,
                 *_,
-            ) = self.get_measurements(group_data)
+            ) = measurements[group_name]
 
             # Plot the results
-            plt.figure(figsize=(10, 6))
-            plt.plot(avg_time, avg_curve_aortic, label='p_aortic_smooth', color='blue')
-            plt.plot(avg_time, avg_curve_distal, label='p_distal_smooth', color='green')
-            plt.axvline(x=start_time_aortic_mean, color='red', linestyle='--', label='Aortic Start/End')
-            plt.axvline(x=end_time_aortic_mean, color='red', linestyle='--')
-            plt.axvline(x=start_time_diastolic_mean, color='blue', linestyle='--', label='Diastolic Start/End')
-            plt.axvline(x=end_time_diastolic_mean, color='blue', linestyle='--')
-            plt.text(
+            ax = self._ax
+            ax.clear()
+            ax.plot(avg_time, avg_curve_aortic, label='p_aortic_smooth', color='blue')
+            ax.plot(avg_time, avg_curve_distal, label='p_distal_smooth', color='green')
+            ax.axvline(x=start_time_aortic_mean, color='red', linestyle='--', label='Aortic Start/End')
+            ax.axvline(x=end_time_aortic_mean, color='red', linestyle='--')
+            ax.axvline(x=start_time_diastolic_mean, color='blue', linestyle='--', label='Diastolic Start/End')
+            ax.axvline(x=end_time_diastolic_mean, color='blue', linestyle='--')
+            ax.text(
                 0.5,
                 0.9,
                 f'iFR: {iFR_mean:.2f}',
                 horizontalalignment='center',
                 verticalalignment='center',
-                transform=plt.gca().transAxes,
+                transform=ax.transAxes,
             )
-            plt.text(
+            ax.text(
                 0.5,
                 0.85,
                 f'mid_systolic_ratio: {mid_systolic_ratio_mean:.2f}',
                 horizontalalignment='center',
                 verticalalignment='center',
-                transform=plt.gca().transAxes,
+                transform=ax.transAxes,
             )
-            plt.text(
+            ax.text(
                 0.5,
                 0.8,
                 f'pd/pa: {pdpa_mean:.2f}',
                 horizontalalignment='center',
                 verticalalignment='center',
-                transform=plt.gca().transAxes,
+                transform=ax.transAxes,
             )
-            plt.xlabel('Time')
-            plt.ylabel('Pressure')
-            plt.title(f'Average Curve between Diastolic Peaks ({name.capitalize()} - {group_name.capitalize()})')
-            plt.legend()
+            ax.set_xlabel('Time')
+            ax.set_ylabel('Pressure')
+            ax.set_title(f'Average Curve between Diastolic Peaks ({name.capitalize()} - {group_name.capitalize()})')
+            ax.legend()
 
             # Save the plot in the same directory as the CSV file
             plot_filename = os.path.join(output_dir, f"{file_name}_average_curve_{group_name}.png")
-            plt.savefig(plot_filename)
-            plt.close()  # Close the plot to free up memory
+            self._save_figure(self._fig, plot_filename)
 
     def plot_pdpa_iFR_midsystolic_over_time(self, data, file_name, output_dir):
         """
         Plots the pd/pa ratio, iFR, and mid-systolic ratio over time for all patients.
         """
-        name = 'rest' if 'rest' in file_name else 'ado' if 'ade' in file_name else 'dobu'
-        data = data.copy()
+        name = get_measurement_name(file_name)
         data = data.dropna(subset=['pd/pa', 'iFR', 'mid_systolic_ratio'])
 
         # Initialize the plot
-        plt.figure(figsize=(12, 8))
+        ax = self._ax_over_time
+        ax.clear()
 
         # Plot the pd/pa ratio
-        plt.plot(data['time'], data['pd/pa'], label='pd/pa', color='blue')
-        plt.plot(data['time'], data['iFR'], label='iFR', color='green')
-        plt.plot(data['time'], data['mid_systolic_ratio'], label='mid-systolic ratio', color='red')
-        plt.hlines(y=0.8, xmin=data['time'].min(), xmax=data['time'].max(), color='red', linestyle='--', label='Threshold')
-        plt.xlabel('Time')
-        plt.ylabel('Value')
-        plt.title(f'pd/pa, iFR, and Mid-Systolic Ratio Over Time ({name.capitalize()})')
-        plt.legend()
+        ax.plot(data['time'], data['pd/pa'], label='pd/pa', color='blue')
+        ax.plot(data['time'], data['iFR'], label='iFR', color='green')
+        ax.plot(data['time'], data['mid_systolic_ratio'], label='mid-systolic ratio', color='red')
+        ax.hlines(
+            y=0.8, xmin=data['time'].min(), xmax=data['time'].max(), color='red', linestyle='--', label='Threshold'
+        )
+        ax.set_xlabel('Time')
+        ax.set_ylabel('Value')
+        ax.set_title(f'pd/pa, iFR, and Mid-Systolic Ratio Over Time ({name.capitalize()})')
+        ax.legend()
 
         # Save the plot in the same directory as the CSV file
         plot_filename = os.path.join(output_dir, f"{file_name}_pdpa_iFR_midsystolic_over_time.png")
-        plt.savefig(plot_filename)
-        plt.close()  # Close the plot to free up memory
\ No newline at end of file
+        self._save_figure(self._fig_over_time, plot_filename)